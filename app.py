@@ -1,13 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import HTTPException
 from openai import OpenAI
 from dotenv import load_dotenv
 import os
 from flask_cors import CORS
+from interview import (
+    QUESTIONS, MODEL, TURN_MODE, TURN_SCHEMA,
+    build_analysis_prompt, build_persona_prompt, build_single_call_prompt, sse_event,
+    parse_chat_request, save_turn, decide_stage_locally, stage_check_verdict,
+    stage_check_failed, persona_degraded, single_call_verdict, single_call_degraded
+)
+from session_store import create_session_store
+from prompt_builder import preload_encoding
+import metrics
+import governor
+import turn_log
 
 # Load environment variables
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Retries are handled by the governor, which knows each call's deadline
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+upstream = governor.Governor()
+
+sessions = create_session_store()
+
+preload_encoding()
 
 app = Flask(__name__)
 
@@ -21,119 +40,173 @@ CORS(app, resources={
     }
 })
 
-# --- CONFIGURATION ---
-QUESTIONS = [
-    {
-        "id": "decision_factor",
-        "question": "What was the most important factor shaping your decision?",
-    },
-    {
-        "id": "info_needs",
-        "question": "Is there any other information you would want to know about the crisis in Kenya to make a better informed decision?",
-    },
-    {
-        "id": "additional_actions",
-        "question": "Beyond US aid, do you think the US should take any additional actions toward Kenya in light of the crisis?",
-    }
-]
-
-SYSTEM_PERSONA = (
-    "You are a senior director of the U.S. National Security Council. "
-    "Speak professionally and calmly. You are an authority figure. "
-    "Keep your responses concise (2-3 sentences max) to keep the user engaged."
-)
-
 @app.after_request
 def after_request(response):
     response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
     response.headers.add("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
     return response
 
-def is_current_question_answered(transcript, user_message, current_q):
+def is_current_question_answered(history, user_message, current_q):
     """
     Checks ONLY if the specific current question has been addressed.
     This prevents the AI from skipping multiple stages at once.
     """
-    # Safety Check: If the question text appears 2+ times, force move on
-    if transcript.count(current_q['question']) >= 2:
-        return True
+    verdict = decide_stage_locally(history, user_message, current_q)
+    if verdict is not None:
+        return verdict
+
+    analysis_prompt = build_analysis_prompt(user_message, current_q)
+
+    try:
+        response = upstream.call(
+            lambda timeout: client.chat.completions.create(
+                model=MODEL,
+                messages=analysis_prompt.messages,
+                temperature=0,
+                timeout=timeout
+            ),
+            tokens=analysis_prompt.tokens + governor.STAGE_CHECK_MAX_TOKENS,
+            deadline=governor.UPSTREAM_STAGE_CHECK_DEADLINE
+        )
+        return stage_check_verdict(response, user_message, current_q)
+    except Exception as e:
+        return stage_check_failed(e, user_message, current_q)
 
-    analysis_prompt = f"""
-    You are a logic engine. Analyze the user's latest message in the context of the question asked.
-    
-    Current Question Asked: "{current_q['question']}"
-    User's Latest Message: "{user_message}"
+def generate_reply(history, user_message, current_index):
+    prompt = build_persona_prompt(history, user_message, current_index)
+    try:
+        response = upstream.call(
+            lambda timeout: client.chat.completions.create(
+                model=MODEL,
+                messages=prompt.messages,
+                temperature=0.7,
+                timeout=timeout
+            ),
+            tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS
+        )
+    except governor.DEGRADED as e:
+        return persona_degraded(e, current_index)
+    except Exception:
+        metrics.record_upstream("persona", error=True)
+        raise
+    metrics.record_upstream("persona", response)
+    return response.choices[0].message.content
 
-    Did the user provide an answer to THIS SPECIFIC question? 
-    (Accept brief or vague answers like "none", "not sure", or "I already told you", but they must have replied to this topic).
+def stream_reply(history, user_message, current_index):
+    """
+    Yields the persona reply token by token as OpenAI streams it.
+    """
+    prompt = build_persona_prompt(history, user_message, current_index)
+    usage_chunk = None
+    try:
+        try:
+            stream = upstream.call(
+                lambda timeout: client.chat.completions.create(
+                    model=MODEL,
+                    messages=prompt.messages,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ),
+                tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS,
+                hedge=False
+            )
+        except governor.DEGRADED as e:
+            yield persona_degraded(e, current_index, "persona_stream")
+            return
+        for chunk in stream:
+            if chunk.usage:
+                usage_chunk = chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception:
+        metrics.record_upstream("persona", error=True)
+        raise
+    metrics.record_upstream("persona", usage_chunk)
 
-    Respond with ONLY 'YES' or 'NO'.
+def two_call_turn(history, user_message, current_index):
+    """
+    Original turn pipeline: stage check first, then the persona reply.
+    Returns (answered, new_index, reply); answered is None once the interview is over.
     """
+    answered = None
+    if current_index < len(QUESTIONS):
+        with metrics.span("stage_check"):
+            answered = is_current_question_answered(history, user_message, QUESTIONS[current_index])
+        if answered:
+            current_index += 1
+
+    with metrics.span("generate"):
+        reply = generate_reply(history, user_message, current_index)
+    return answered, current_index, reply
 
+def single_call_turn(history, user_message, current_index):
+    """
+    Gets the stage verdict and the persona reply from ONE structured-output call.
+    Returns (answered, new_index, reply), or None if the output can't be trusted
+    or the call failed for a non-retryable reason, so the caller can fall back to
+    the two-call path. Rate limits and timeouts get a degraded turn instead.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": analysis_prompt}],
-            temperature=0
-        )
-        return "YES" in response.choices[0].message.content.upper()
+        prompt = build_single_call_prompt(history, user_message, current_index)
+        with metrics.span("single_call"):
+            response = upstream.call(
+                lambda timeout: client.chat.completions.create(
+                    model=MODEL,
+                    messages=prompt.messages,
+                    temperature=0.7,
+                    response_format={"type": "json_schema", "json_schema": TURN_SCHEMA},
+                    timeout=timeout
+                ),
+                tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS
+            )
+    except governor.DEGRADED as e:
+        # The deadline is spent; two more calls would only push the turn past it
+        return single_call_degraded(e, history, user_message, current_index)
     except Exception as e:
-        print(f"Logic Error: {e}")
-        return False
+        metrics.record_upstream("single_call", error=True)
+        print(f"Single-call Error: {e}")
+        return None
+
+    return single_call_verdict(response, history, current_index)
+
+def run_turn(history, user_message, current_index):
+    if TURN_MODE == "single_call" and current_index < len(QUESTIONS):
+        result = single_call_turn(history, user_message, current_index)
+        if result is not None:
+            return result
+    return two_call_turn(history, user_message, current_index)
+
+def read_payload(turn):
+    try:
+        return request.json
+    except HTTPException as e:
+        # Non-JSON body (415) or malformed JSON (400)
+        turn.finish(e.code)
+        raise
 
 @app.route("/chat", methods=["POST", "OPTIONS"])
 def chat():
     if request.method == "OPTIONS":
         return jsonify({"status": "OK"}), 200
 
-    user_message = request.json.get("message", "").strip()
-    transcript = request.json.get("transcript", "")
-    
-    # Receive the current stage from Qualtrics (0, 1, or 2)
-    current_index = int(request.json.get("current_stage_index", 0))
+    turn = metrics.start_turn(request.path)
+    user_message, history, current_index, session = parse_chat_request(read_payload(turn), sessions)
 
     if not user_message:
+        turn.finish(400)
         return jsonify({"error": "No message provided"}), 400
 
-    # --- 1. DETERMINE IF WE MOVE FORWARD (MAX +1) ---
-    if current_index < len(QUESTIONS):
-        answered = is_current_question_answered(transcript, user_message, QUESTIONS[current_index])
-        if answered:
-            current_index += 1
-
-    # --- 2. SELECT THE NEXT TASK ---
-    if current_index < len(QUESTIONS):
-        next_q = QUESTIONS[current_index]
-        task_instruction = f"Acknowledge the user's point briefly. Then, ask EXACTLY this question: '{next_q['question']}'"
-    else:
-        task_instruction = "The interview is over. Thank them and tell them to click the arrow to proceed. Do not ask more questions."
-
-    full_system_prompt = f"{SYSTEM_PERSONA}\n\nCURRENT TASK: {task_instruction}"
-
-    # --- 3. CONSTRUCT PERSONA RESPONSE ---
-    messages = [{"role": "system", "content": full_system_prompt}]
-    
-    # Reconstruct history from transcript for the assistant's context
-    if transcript:
-        for line in transcript.split("\n"):
-            line = line.strip()
-            if not line: continue
-            if line.startswith("YOU:"):
-                messages.append({"role": "user", "content": line.replace("YOU:", "").strip()})
-            elif line.startswith("NSC DIRECTOR:"):
-                messages.append({"role": "assistant", "content": line.replace("NSC DIRECTOR:", "").strip()})
-
-    messages.append({"role": "user", "content": user_message})
-
+    # --- 1. DETERMINE IF WE MOVE FORWARD (MAX +1) AND CONSTRUCT PERSONA RESPONSE ---
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7
-        )
+        answered, new_index, bot_reply = run_turn(history, user_message, current_index)
+        turn.stage(current_index, new_index, len(QUESTIONS))
+        save_turn(sessions, session, user_message, bot_reply, new_index)
+        turn.finish(200)
+        turn_log.capture(turn, session, user_message, history, current_index, new_index, answered, bot_reply)
+        current_index = new_index
 
-        bot_reply = response.choices[0].message.content
-        
         # Return BOTH the reply and the updated index for Qualtrics to store
         return jsonify({
             "reply": bot_reply,
@@ -141,7 +214,79 @@ def chat():
         })
 
     except Exception as e:
+        turn.finish(500)
+        turn_log.capture(turn, session, user_message, history, current_index, current_index, None, None, str(e))
         return jsonify({"error": str(e)}), 500
 
+@app.route("/chat/stream", methods=["POST", "OPTIONS"])
+def chat_stream():
+    """
+    Same inputs as /chat, but answers with Server-Sent Events:
+      event: stage  {"current_stage_index": n}   as soon as the stage is decided
+      event: token  {"delta": "..."}             for each piece of the reply
+      event: done   {"reply": "...", "current_stage_index": n}
+      event: error  {"error": "..."}             if generation fails mid-stream
+    """
+    if request.method == "OPTIONS":
+        return jsonify({"status": "OK"}), 200
+
+    turn = metrics.start_turn(request.path)
+    user_message, history, current_index, session = parse_chat_request(read_payload(turn), sessions)
+
+    if not user_message:
+        turn.finish(400)
+        return jsonify({"error": "No message provided"}), 400
+
+    def generate():
+        metrics.current_turn.set(turn)
+        index = current_index
+        answered = None
+        parts = []
+        recorded = False
+        try:
+            # --- 1. DETERMINE IF WE MOVE FORWARD (MAX +1) ---
+            if index < len(QUESTIONS):
+                with metrics.span("stage_check"):
+                    if is_current_question_answered(history, user_message, QUESTIONS[index]):
+                        index += 1
+            turn.stage(current_index, index, len(QUESTIONS))
+            answered = index > current_index if current_index < len(QUESTIONS) else None
+            yield sse_event("stage", {"current_stage_index": index})
+
+            # --- 2. STREAM PERSONA RESPONSE ---
+            try:
+                with metrics.span("generate"):
+                    for delta in stream_reply(history, user_message, index):
+                        parts.append(delta)
+                        yield sse_event("token", {"delta": delta})
+            except Exception as e:
+                recorded = True
+                turn.finish("stream_error")
+                turn_log.capture(turn, session, user_message, history, current_index, index, answered, "".join(parts), str(e))
+                yield sse_event("error", {"error": str(e)})
+                return
+
+            bot_reply = "".join(parts)
+            save_turn(sessions, session, user_message, bot_reply, index)
+            recorded = True
+            turn.finish(200)
+            turn_log.capture(turn, session, user_message, history, current_index, index, answered, bot_reply)
+            yield sse_event("done", {"reply": bot_reply, "current_stage_index": index})
+        finally:
+            if not recorded:
+                # The participant closed the page mid-stream; keep the partial turn for the study
+                turn.finish("client_disconnected")
+                turn_log.capture(turn, session, user_message, history, current_index, index, answered,
+                                 "".join(parts), "client_disconnected")
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,302 @@
+"""
+Async version of app.py for survey waves with many concurrent participants.
+
+Same routes and request/response contract as app.py, but the handlers await a
+shared AsyncOpenAI client instead of blocking a worker, so one process can
+hold hundreds of in-flight conversations.
+
+Run with:  gunicorn -c gunicorn_async.conf.py asgi_app:app
+"""
+from quart import Quart, request, jsonify, Response, abort
+from werkzeug.exceptions import HTTPException
+from quart_cors import cors
+from openai import AsyncOpenAI
+import asyncio
+import httpx
+import os
+from interview import (
+    QUESTIONS, MODEL, TURN_MODE, TURN_SCHEMA,
+    build_analysis_prompt, build_persona_prompt, build_single_call_prompt, sse_event,
+    parse_chat_request, save_turn, decide_stage_locally, stage_check_verdict,
+    stage_check_failed, persona_degraded, single_call_verdict, single_call_degraded
+)
+from session_store import create_session_store
+from prompt_builder import preload_encoding
+import metrics
+import governor
+import turn_log
+
+# Connection pool shared by every request in this worker. Keep-alive
+# connections skip the TCP/TLS handshake on each upstream call.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "50"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+client = None
+
+upstream = governor.AsyncGovernor()
+
+# Session reads and writes run in a thread: under write contention between
+# workers a SQLite append can wait up to its 10s lock timeout
+sessions = create_session_store()
+
+app = Quart(__name__)
+
+# CORS for Qualtrics
+app = cors(app, allow_origin=[
+    "https://unc.az1.qualtrics.com",
+    "https://unc.pdx1.qualtrics.com"
+])
+
+@app.before_serving
+async def open_client():
+    global client
+    preload_encoding()
+    client = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        # Retries are handled by the governor, which knows each call's deadline
+        max_retries=0,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+    )
+
+@app.after_serving
+async def close_client():
+    await client.close()
+
+@app.after_request
+async def after_request(response):
+    response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization")
+    response.headers.add("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
+    return response
+
+async def is_current_question_answered(history, user_message, current_q):
+    """
+    Checks ONLY if the specific current question has been addressed.
+    This prevents the AI from skipping multiple stages at once.
+    """
+    verdict = decide_stage_locally(history, user_message, current_q)
+    if verdict is not None:
+        return verdict
+
+    analysis_prompt = build_analysis_prompt(user_message, current_q)
+
+    try:
+        response = await upstream.call(
+            lambda timeout: client.chat.completions.create(
+                model=MODEL,
+                messages=analysis_prompt.messages,
+                temperature=0,
+                timeout=timeout
+            ),
+            tokens=analysis_prompt.tokens + governor.STAGE_CHECK_MAX_TOKENS,
+            deadline=governor.UPSTREAM_STAGE_CHECK_DEADLINE
+        )
+        return stage_check_verdict(response, user_message, current_q)
+    except Exception as e:
+        return stage_check_failed(e, user_message, current_q)
+
+async def generate_reply(history, user_message, current_index):
+    prompt = build_persona_prompt(history, user_message, current_index)
+    try:
+        response = await upstream.call(
+            lambda timeout: client.chat.completions.create(
+                model=MODEL,
+                messages=prompt.messages,
+                temperature=0.7,
+                timeout=timeout
+            ),
+            tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS
+        )
+    except governor.DEGRADED as e:
+        return persona_degraded(e, current_index)
+    except Exception:
+        metrics.record_upstream("persona", error=True)
+        raise
+    metrics.record_upstream("persona", response)
+    return response.choices[0].message.content
+
+async def stream_reply(history, user_message, current_index):
+    prompt = build_persona_prompt(history, user_message, current_index)
+    usage_chunk = None
+    try:
+        try:
+            stream = await upstream.call(
+                lambda timeout: client.chat.completions.create(
+                    model=MODEL,
+                    messages=prompt.messages,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ),
+                tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS,
+                hedge=False
+            )
+        except governor.DEGRADED as e:
+            yield persona_degraded(e, current_index, "persona_stream")
+            return
+        async for chunk in stream:
+            if chunk.usage:
+                usage_chunk = chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception:
+        metrics.record_upstream("persona", error=True)
+        raise
+    metrics.record_upstream("persona", usage_chunk)
+
+async def two_call_turn(history, user_message, current_index):
+    answered = None
+    if current_index < len(QUESTIONS):
+        with metrics.span("stage_check"):
+            answered = await is_current_question_answered(history, user_message, QUESTIONS[current_index])
+        if answered:
+            current_index += 1
+
+    with metrics.span("generate"):
+        reply = await generate_reply(history, user_message, current_index)
+    return answered, current_index, reply
+
+async def single_call_turn(history, user_message, current_index):
+    try:
+        prompt = build_single_call_prompt(history, user_message, current_index)
+        with metrics.span("single_call"):
+            response = await upstream.call(
+                lambda timeout: client.chat.completions.create(
+                    model=MODEL,
+                    messages=prompt.messages,
+                    temperature=0.7,
+                    response_format={"type": "json_schema", "json_schema": TURN_SCHEMA},
+                    timeout=timeout
+                ),
+                tokens=prompt.tokens + governor.PERSONA_MAX_TOKENS
+            )
+    except governor.DEGRADED as e:
+        # The deadline is spent; two more calls would only push the turn past it
+        return single_call_degraded(e, history, user_message, current_index)
+    except Exception as e:
+        metrics.record_upstream("single_call", error=True)
+        print(f"Single-call Error: {e}")
+        return None
+
+    return single_call_verdict(response, history, current_index)
+
+async def run_turn(history, user_message, current_index):
+    if TURN_MODE == "single_call" and current_index < len(QUESTIONS):
+        result = await single_call_turn(history, user_message, current_index)
+        if result is not None:
+            return result
+    return await two_call_turn(history, user_message, current_index)
+
+async def read_payload(turn):
+    try:
+        payload = await request.get_json()
+    except HTTPException as e:
+        turn.finish(e.code)
+        raise
+    if payload is None:
+        # Quart returns None for a non-JSON body where Flask answers 415
+        turn.finish(415)
+        abort(415)
+    return payload
+
+@app.route("/chat", methods=["POST", "OPTIONS"])
+async def chat():
+    if request.method == "OPTIONS":
+        return jsonify({"status": "OK"}), 200
+
+    turn = metrics.start_turn(request.path)
+    user_message, history, current_index, session = await asyncio.to_thread(parse_chat_request, await read_payload(turn), sessions)
+
+    if not user_message:
+        turn.finish(400)
+        return jsonify({"error": "No message provided"}), 400
+
+    try:
+        answered, new_index, bot_reply = await run_turn(history, user_message, current_index)
+        turn.stage(current_index, new_index, len(QUESTIONS))
+        await asyncio.to_thread(save_turn, sessions, session, user_message, bot_reply, new_index)
+        turn.finish(200)
+        turn_log.capture(turn, session, user_message, history, current_index, new_index, answered, bot_reply)
+        current_index = new_index
+
+        return jsonify({
+            "reply": bot_reply,
+            "current_stage_index": current_index
+        })
+
+    except Exception as e:
+        turn.finish(500)
+        turn_log.capture(turn, session, user_message, history, current_index, current_index, None, None, str(e))
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/chat/stream", methods=["POST", "OPTIONS"])
+async def chat_stream():
+    if request.method == "OPTIONS":
+        return jsonify({"status": "OK"}), 200
+
+    turn = metrics.start_turn(request.path)
+    user_message, history, current_index, session = await asyncio.to_thread(parse_chat_request, await read_payload(turn), sessions)
+
+    if not user_message:
+        turn.finish(400)
+        return jsonify({"error": "No message provided"}), 400
+
+    async def generate():
+        metrics.current_turn.set(turn)
+        index = current_index
+        answered = None
+        parts = []
+        recorded = False
+        try:
+            if index < len(QUESTIONS):
+                with metrics.span("stage_check"):
+                    if await is_current_question_answered(history, user_message, QUESTIONS[index]):
+                        index += 1
+            turn.stage(current_index, index, len(QUESTIONS))
+            answered = index > current_index if current_index < len(QUESTIONS) else None
+            yield sse_event("stage", {"current_stage_index": index})
+
+            try:
+                with metrics.span("generate"):
+                    async for delta in stream_reply(history, user_message, index):
+                        parts.append(delta)
+                        yield sse_event("token", {"delta": delta})
+            except Exception as e:
+                recorded = True
+                turn.finish("stream_error")
+                turn_log.capture(turn, session, user_message, history, current_index, index, answered, "".join(parts), str(e))
+                yield sse_event("error", {"error": str(e)})
+                return
+
+            bot_reply = "".join(parts)
+            await asyncio.to_thread(save_turn, sessions, session, user_message, bot_reply, index)
+            recorded = True
+            turn.finish(200)
+            turn_log.capture(turn, session, user_message, history, current_index, index, answered, bot_reply)
+            yield sse_event("done", {"reply": bot_reply, "current_stage_index": index})
+        finally:
+            if not recorded:
+                # The participant closed the page mid-stream; keep the partial turn for the study
+                turn.finish("client_disconnected")
+                turn_log.capture(turn, session, user_message, history, current_index, index, answered,
+                                 "".join(parts), "client_disconnected")
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
+    app.run(debug=True)
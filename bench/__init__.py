@@ -0,0 +1,8 @@
+"""
+Offline load testing for the /chat pipeline.
+
+  fake_openai - local OpenAI-compatible server with configurable latency and errors
+  simulate    - concurrent scripted Qualtrics participants
+  report      - throughput, latency percentiles, upstream calls per turn
+  run         - all of the above against the app under gunicorn (python -m bench.run)
+"""
@@ -0,0 +1,227 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests that must
+not touch the real account.
+
+Answers POST /v1/chat/completions (plain and stream=True) after a sampled delay
+and can inject 429 and 5xx errors. It recognizes the app's three call types:
+  stage check  -> "YES" / "NO"
+  single-call  -> {"answered": ..., "reply": ...} when response_format is set
+  persona      -> a short canned reply
+GET /stats returns call counters; POST /stats/reset zeroes them.
+
+Standalone: python -m bench.fake_openai --port 8900 --latency lognormal:0.8,0.5
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+PERSONA_REPLY = (
+    "Thank you, that is a helpful perspective for the Council. "
+    "Let me ask you one more thing before we wrap up this part of the briefing."
+)
+
+def parse_latency(spec):
+    """
+    Latency distribution spec -> function returning seconds.
+      fixed:S            always S
+      uniform:A,B        uniform between A and B
+      lognormal:MED,SIG  lognormal with median MED and shape SIG (long right tail)
+    """
+    kind, _, args = spec.partition(":")
+    params = [float(x) for x in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "lognormal":
+        mu = math.log(params[0])
+        return lambda: random.lognormvariate(mu, params[1])
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 resets connections under load, which the
+    # app sees as APIConnectionError and retries: that would be measuring us
+    request_queue_size = 1024
+
+    def __init__(self, address, latency="lognormal:0.8,0.5", token_interval=0.02,
+                 rate_429=0.0, rate_5xx=0.0, yes_rate=0.85, retry_after=1):
+        super().__init__(address, FakeOpenAIHandler)
+        self.sample_latency = parse_latency(latency)
+        self.token_interval = token_interval
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.yes_rate = yes_rate
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0, "stage_checks": 0, "single_calls": 0, "persona_calls": 0,
+                "streams": 0, "errors_429": 0, "errors_5xx": 0,
+                "prompt_tokens": 0, "completion_tokens": 0
+            }
+
+    def count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.server.snapshot())
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/stats/reset":
+            self.server.reset_stats()
+            self.send_json(200, {"status": "OK"})
+            return
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        server = self.server
+        server.count(requests=1)
+        delay = server.sample_latency()
+
+        roll = random.random()
+        if roll < server.rate_429:
+            time.sleep(min(delay, 0.05))
+            server.count(errors_429=1)
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                           {"Retry-After": str(server.retry_after)})
+            return
+        if roll < server.rate_429 + server.rate_5xx:
+            time.sleep(delay)
+            server.count(errors_5xx=1)
+            self.send_json(random.choice([500, 502, 503]), {"error": {"message": "Upstream error", "type": "server_error"}})
+            return
+
+        content, kind = self.completion_content(body)
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in body.get("messages", []))
+        completion_tokens = len(content) // 4 + 1
+        server.count(**{kind: 1, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        if body.get("stream"):
+            server.count(streams=1)
+            self.stream_completion(body, content, delay)
+        else:
+            time.sleep(delay)
+            self.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage
+            })
+
+    def completion_content(self, body):
+        messages = body.get("messages", [])
+        first = messages[0].get("content", "") if messages else ""
+        answered = random.random() < self.server.yes_rate
+
+        if body.get("response_format"):
+            return json.dumps({"answered": answered, "reply": PERSONA_REPLY}), "single_calls"
+        if first.startswith("You are a logic engine"):
+            return ("YES" if answered else "NO"), "stage_checks"
+        return PERSONA_REPLY, "persona_calls"
+
+    def stream_completion(self, body, content, delay):
+        # Streams are sent without Content-Length, so close the connection afterwards
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        time.sleep(delay)
+        for i, word in enumerate(content.split(" ")):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"content": word if i == 0 else f" {word}"}}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.server.token_interval)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:0.8,0.5",
+                        help="upstream latency: fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="fraction of calls answered with 5xx")
+    parser.add_argument("--yes-rate", type=float, default=0.85, help="fraction of stage checks answered YES")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+
+def create_server(args, host="127.0.0.1", port=0):
+    return FakeOpenAIServer(
+        (host, port), latency=args.latency, token_interval=args.token_interval,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, yes_rate=args.yes_rate,
+        retry_after=args.retry_after
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args, args.host, args.port)
+    print(f"Fake OpenAI API listening at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
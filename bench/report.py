@@ -0,0 +1,72 @@
+"""
+Summaries for benchmark runs: throughput, turn latency percentiles and
+upstream calls per turn.
+"""
+import json
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank, so p99 of a small run is a real observed turn
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(turns, completed, participants, elapsed, upstream=None):
+    ok = [t for t in turns if t["ok"]]
+    latencies = [t["latency"] for t in ok]
+    ttfts = [t["ttft"] for t in ok if t.get("ttft") is not None]
+
+    errors = {}
+    for t in turns:
+        if not t["ok"]:
+            errors[str(t["status"])] = errors.get(str(t["status"]), 0) + 1
+
+    summary = {
+        "participants": participants,
+        "completed_interviews": completed,
+        "turns": len(turns),
+        "failed_turns": len(turns) - len(ok),
+        "errors_by_status": errors,
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": len(ok) / elapsed if elapsed else 0.0,
+        "latency_s": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None
+        }
+    }
+    if ttfts:
+        summary["ttft_s"] = {
+            "p50": percentile(ttfts, 50),
+            "p95": percentile(ttfts, 95),
+            "p99": percentile(ttfts, 99)
+        }
+    if upstream is not None:
+        summary["upstream"] = upstream
+        summary["upstream_calls_per_turn"] = upstream["requests"] / len(turns) if turns else 0.0
+    return summary
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+def format_report(summary):
+    lat = summary["latency_s"]
+    lines = [
+        f"Participants:          {summary['participants']} ({summary['completed_interviews']} finished all stages)",
+        f"Turns:                 {summary['turns']} ({summary['failed_turns']} failed"
+        + (f": {json.dumps(summary['errors_by_status'])}" if summary["errors_by_status"] else "") + ")",
+        f"Elapsed:               {summary['elapsed_s']:.1f}s",
+        f"Throughput:            {summary['throughput_turns_per_s']:.2f} turns/s",
+        f"Turn latency:          p50 {_ms(lat['p50'])}  p95 {_ms(lat['p95'])}  p99 {_ms(lat['p99'])}  max {_ms(lat['max'])}",
+    ]
+    if "ttft_s" in summary:
+        ttft = summary["ttft_s"]
+        lines.append(f"Time to first token:   p50 {_ms(ttft['p50'])}  p95 {_ms(ttft['p95'])}  p99 {_ms(ttft['p99'])}")
+    if "upstream" in summary:
+        up = summary["upstream"]
+        lines.append(f"Upstream calls/turn:   {summary['upstream_calls_per_turn']:.2f} "
+                     f"(stage checks {up['stage_checks']}, single-call {up['single_calls']}, "
+                     f"persona {up['persona_calls']}, 429s {up['errors_429']}, 5xx {up['errors_5xx']})")
+    return "\n".join(lines)
@@ -0,0 +1,111 @@
+"""
+End-to-end load test: fake OpenAI API + the app under gunicorn + simulated participants.
+
+By default the app is started with the command from Procfile.txt, so the
+numbers reflect the production worker model. Pass --cmd to compare another
+one, e.g. the async app:
+
+  python -m bench.run --participants 100
+  python -m bench.run --participants 100 --cmd "gunicorn -c gunicorn_async.conf.py asgi_app:app"
+  python -m bench.run --participants 100 --gunicorn-args "--workers 4 --threads 8"
+  python -m bench.run --rate-429 0.05 --latency lognormal:1.2,0.8 --json results.json
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench.fake_openai import add_server_arguments, create_server
+from bench.report import summarize, format_report
+from bench.simulate import add_simulation_arguments, run_simulation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def procfile_command():
+    with open(os.path.join(ROOT, "Procfile.txt")) as f:
+        for line in f:
+            name, _, command = line.partition(":")
+            if name.strip() == "web":
+                return command.strip()
+    raise RuntimeError("No web process in Procfile.txt")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited during startup with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"App did not start listening on port {port} within {timeout}s")
+
+def upstream_stats(base_url):
+    with urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats") as response:
+        return json.loads(response.read())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cmd", help="command that starts the app (default: web process from Procfile.txt)")
+    parser.add_argument("--gunicorn-args", default="", help="extra arguments appended to the command")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, e.g. TURN_MODE=single_call (repeatable)")
+    parser.add_argument("--json", help="also write the summary to this file")
+    add_server_arguments(parser)
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    fake = create_server(args)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    port = free_port()
+    command = shlex.split(args.cmd or procfile_command()) + shlex.split(args.gunicorn_args)
+    command += ["--bind", f"127.0.0.1:{port}"]
+
+    # Keep synthetic turns out of the study's turn logs and the live /metrics totals
+    metrics_dir = tempfile.mkdtemp(prefix="bench-metrics-")
+    env = dict(os.environ, OPENAI_BASE_URL=fake.base_url, OPENAI_API_KEY="sk-bench",
+               TURN_LOG_ENABLED="0", METRICS_DIR=metrics_dir)
+    env.update(kv.split("=", 1) for kv in args.env)
+
+    print(f"Fake upstream: {fake.base_url}")
+    print(f"App command:   {' '.join(command)}")
+    app = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        wait_for_port(port, app)
+        turns, completed, elapsed = run_simulation(
+            f"http://127.0.0.1:{port}", args.participants, args.ramp_up, args.max_turns,
+            args.think_time, args.timeout, args.stream, args.session
+        )
+        summary = summarize(turns, completed, args.participants, elapsed, upstream_stats(fake.base_url))
+    finally:
+        app.terminate()
+        try:
+            app.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            app.kill()
+        fake.shutdown()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    summary["command"] = " ".join(command)
+    print()
+    print(format_report(summary))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
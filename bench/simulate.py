@@ -0,0 +1,179 @@
+"""
+Scripted Qualtrics participants hitting a running app concurrently.
+
+Each participant behaves like the survey page: it POSTs to /chat with its
+message, the transcript so far and the stage index it was last given, and keeps
+going until the stage index reaches len(QUESTIONS) (or it runs out of turns).
+
+Standalone: python -m bench.simulate --url http://127.0.0.1:8000 --participants 50
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from interview import QUESTIONS
+
+# Scripted replies per stage; a mix of clear answers and ones the fast path can't decide
+ANSWERS = [
+    [
+        "Mostly the risk to American personnel on the ground.",
+        "The humanitarian cost. People are dying and we have a moral obligation to help.",
+        "Honestly I went with my gut on this one.",
+        "not sure",
+    ],
+    [
+        "I'd want to know how many people have been displaced and whether the government is stable.",
+        "none",
+        "What are the other countries in the region doing about it?",
+        "Maybe more about the timeline.",
+    ],
+    [
+        "We should impose targeted sanctions on the officials involved.",
+        "No.",
+        "I think aid is enough, we shouldn't get more involved.",
+        "Push for talks between the parties, through the African Union if possible.",
+    ],
+]
+
+OPENING = "Hello, I'm ready to begin."
+
+QUALTRICS_ORIGIN = "https://unc.az1.qualtrics.com"
+
+def post_json(url, payload, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json", "Origin": QUALTRICS_ORIGIN}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def post_stream(url, payload, timeout):
+    """
+    Reads a /chat/stream response. Returns (final event data, seconds to first token).
+    """
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json", "Origin": QUALTRICS_ORIGIN}
+    )
+    start = time.perf_counter()
+    first_token = None
+    event = None
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        for raw in response:
+            line = raw.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == "done":
+                    return data, first_token
+                elif event == "error":
+                    raise RuntimeError(data.get("error"))
+    raise RuntimeError("stream ended without a done event")
+
+def run_participant(base_url, max_turns, think_time, timeout, stream=False, session=False):
+    """
+    Walks one participant through the interview. Returns a list of per-turn
+    dicts: {"latency", "ttft", "ok", "status", "advanced"}.
+    """
+    turns = []
+    transcript = ""
+    stage = 0
+    session_id = uuid.uuid4().hex if session else None
+    endpoint = f"{base_url}/chat/stream" if stream else f"{base_url}/chat"
+    message = OPENING
+
+    for _ in range(max_turns):
+        if stage >= len(QUESTIONS):
+            break
+
+        payload = {"message": message, "current_stage_index": stage}
+        if session:
+            payload["session_id"] = session_id
+        else:
+            payload["transcript"] = transcript
+
+        start = time.perf_counter()
+        ttft = None
+        try:
+            if stream:
+                data, ttft = post_stream(endpoint, payload, timeout)
+            else:
+                data = post_json(endpoint, payload, timeout)
+            ok, status = True, 200
+        except urllib.error.HTTPError as e:
+            ok, status, data = False, e.code, None
+        except Exception:
+            ok, status, data = False, 0, None
+        latency = time.perf_counter() - start
+
+        advanced = False
+        if ok:
+            advanced = data["current_stage_index"] > stage
+            stage = data["current_stage_index"]
+            transcript += f"YOU: {message}\nNSC DIRECTOR: {data['reply']}\n"
+
+        turns.append({"latency": latency, "ttft": ttft, "ok": ok, "status": status, "advanced": advanced})
+
+        if stage < len(QUESTIONS):
+            message = random.choice(ANSWERS[stage])
+        time.sleep(think_time * random.random())
+
+    return turns
+
+def run_simulation(base_url, participants, ramp_up=0.0, max_turns=8, think_time=0.0,
+                   timeout=60, stream=False, session=False):
+    """
+    Runs all participants concurrently. Returns (turns, completed participants, elapsed seconds).
+    """
+    lock = threading.Lock()
+    all_turns = []
+    completed = [0]
+
+    def participant(i):
+        if ramp_up:
+            time.sleep(ramp_up * i / participants)
+        turns = run_participant(base_url, max_turns, think_time, timeout, stream, session)
+        with lock:
+            all_turns.extend(turns)
+            if sum(t["advanced"] for t in turns) >= len(QUESTIONS):
+                completed[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=participants) as pool:
+        list(pool.map(participant, range(participants)))
+    return all_turns, completed[0], time.perf_counter() - start
+
+def add_simulation_arguments(parser):
+    parser.add_argument("--participants", type=int, default=20, help="concurrent participants")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which participants start")
+    parser.add_argument("--max-turns", type=int, default=8, help="turns before a participant gives up")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max seconds a participant waits between turns")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request client timeout")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream instead of /chat")
+    parser.add_argument("--session", action="store_true", help="use session mode instead of resending the transcript")
+
+def main():
+    from bench.report import summarize, format_report
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the running app")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    turns, completed, elapsed = run_simulation(
+        args.url.rstrip("/"), args.participants, args.ramp_up, args.max_turns,
+        args.think_time, args.timeout, args.stream, args.session
+    )
+    print(format_report(summarize(turns, completed, args.participants, elapsed)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares the single-call turn mode against the original two-call pipeline.
+
+Runs each sample turn through both paths against the real API and reports
+how often the stage verdicts agree and how much latency the single call saves.
+The single call decides the verdict at temperature 0.7, so with --repeat N it
+also reports how many samples got different verdicts on different runs.
+
+Usage: python compare_turn_modes.py [--repeat N]
+"""
+import argparse
+import statistics
+import time
+
+from app import is_current_question_answered, generate_reply, single_call_turn
+from interview import QUESTIONS, transcript_to_messages
+import stage_classifier
+
+# (stage index, transcript so far, user's latest message)
+SAMPLE_TURNS = [
+    (0, f"NSC DIRECTOR: {QUESTIONS[0]['question']}", "Mostly the risk to American personnel on the ground."),
+    (0, f"NSC DIRECTOR: {QUESTIONS[0]['question']}", "not sure"),
+    (0, f"NSC DIRECTOR: {QUESTIONS[0]['question']}", "What do you mean by decision?"),
+    (0, f"NSC DIRECTOR: {QUESTIONS[0]['question']}", "hello"),
+    (1, f"NSC DIRECTOR: {QUESTIONS[1]['question']}", "none"),
+    (1, f"NSC DIRECTOR: {QUESTIONS[1]['question']}", "I'd want to know how many people have been displaced and whether the government is stable."),
+    (1, f"NSC DIRECTOR: {QUESTIONS[1]['question']}", "Why are you asking me this?"),
+    (2, f"NSC DIRECTOR: {QUESTIONS[2]['question']}", "We should impose targeted sanctions on the officials involved."),
+    (2, f"NSC DIRECTOR: {QUESTIONS[2]['question']}", "I already told you."),
+    (2, f"NSC DIRECTOR: {QUESTIONS[2]['question']}", "Can we talk about something else?"),
+]
+
+def run_two_call(history, user_message, current_index):
+    # Verdicts memoised by earlier repeats would skip the stage-check call
+    stage_classifier.memo.clear()
+    start = time.perf_counter()
+    answered = is_current_question_answered(history, user_message, QUESTIONS[current_index])
+    generate_reply(history, user_message, current_index + 1 if answered else current_index)
+    return answered, time.perf_counter() - start
+
+def run_single_call(history, user_message, current_index):
+    start = time.perf_counter()
+    result = single_call_turn(history, user_message, current_index)
+    elapsed = time.perf_counter() - start
+    return (None if result is None else result[0]), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1, help="times to run each sample turn")
+    args = parser.parse_args()
+
+    agree = disagree = fallbacks = 0
+    two_call_times, single_call_times = [], []
+    # sample -> set of verdicts seen for it, per mode
+    two_call_verdicts, single_call_verdicts = {}, {}
+
+    for _ in range(args.repeat):
+        for current_index, transcript, user_message in SAMPLE_TURNS:
+            history = transcript_to_messages(transcript)
+            expected, two_call_time = run_two_call(history, user_message, current_index)
+            got, single_call_time = run_single_call(history, user_message, current_index)
+            two_call_times.append(two_call_time)
+            two_call_verdicts.setdefault((current_index, user_message), set()).add(expected)
+
+            if got is None:
+                # The app would fall back to the two-call path here
+                fallbacks += 1
+                status = "FALLBACK"
+            else:
+                single_call_times.append(single_call_time)
+                single_call_verdicts.setdefault((current_index, user_message), set()).add(got)
+                if got == expected:
+                    agree += 1
+                    status = "agree"
+                else:
+                    disagree += 1
+                    status = "DISAGREE"
+
+            print(f"[{status:8}] stage {current_index} two-call={expected!s:5} single-call={got!s:5} "
+                  f"{two_call_time * 1000:7.0f}ms vs {single_call_time * 1000:7.0f}ms  {user_message!r}")
+
+    total = agree + disagree + fallbacks
+    print()
+    print(f"Turns compared:      {total}")
+    if agree + disagree:
+        print(f"Verdict agreement:   {agree}/{agree + disagree} ({agree / (agree + disagree):.0%})")
+    print(f"Fallbacks:           {fallbacks}")
+    if args.repeat > 1:
+        unstable = lambda verdicts: sum(len(seen) > 1 for seen in verdicts.values())
+        print(f"Unstable verdicts:   two-call {unstable(two_call_verdicts)}/{len(two_call_verdicts)}, "
+              f"single-call {unstable(single_call_verdicts)}/{len(single_call_verdicts)} samples")
+    if single_call_times:
+        two_call_median = statistics.median(two_call_times)
+        single_call_median = statistics.median(single_call_times)
+        print(f"Two-call median:     {two_call_median * 1000:.0f}ms")
+        print(f"Single-call median:  {single_call_median * 1000:.0f}ms")
+        print(f"Latency saved/turn:  {(two_call_median - single_call_median) * 1000:.0f}ms "
+              f"({1 - single_call_median / two_call_median:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Offline evaluation of the local stage-check fast path (stage_classifier.py).
+
+For each sample reply it runs the local tiers and the gpt-4o-mini check, then
+reports how often the fast path decides on its own (hit rate), how often it
+agrees with the LLM verdict, and the upstream latency saved per turn.
+
+Usage: python evaluate_classifier.py [--samples FILE.jsonl]
+  FILE.jsonl lines look like {"question_id": "info_needs", "message": "none"}
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from openai import OpenAI
+
+from interview import QUESTIONS, MODEL, build_analysis_prompt, parse_verdict
+from stage_classifier import classify
+
+SAMPLES = [
+    ("decision_factor", "Mostly the risk to American personnel on the ground."),
+    ("decision_factor", "The humanitarian cost. People are dying and we have a moral obligation to help."),
+    ("decision_factor", "Cost to taxpayers."),
+    ("decision_factor", "Regional stability and keeping al-Shabaab from gaining ground."),
+    ("decision_factor", "not sure"),
+    ("decision_factor", "none"),
+    ("decision_factor", "I already told you."),
+    ("decision_factor", "What do you mean by decision?"),
+    ("decision_factor", "hello"),
+    ("decision_factor", "ok"),
+    ("decision_factor", "Can you repeat that?"),
+    ("decision_factor", "I am not sure what you mean. Could you explain the question again please. I want to help."),
+    ("decision_factor", "Sorry, I wasn't paying attention. Can you repeat it? I really want to give a good answer here because it is important."),
+    ("info_needs", "none"),
+    ("info_needs", "No, I think I have enough."),
+    ("info_needs", "nope"),
+    ("info_needs", "I'd want to know how many people have been displaced and whether the government is stable."),
+    ("info_needs", "How many people have died?"),
+    ("info_needs", "What other countries are doing to help."),
+    ("info_needs", "Why are you asking me this?"),
+    ("info_needs", "idk"),
+    ("info_needs", "hi"),
+    ("info_needs", "I'm confused. What crisis? I didn't read the scenario. Can you tell me what happened?"),
+    ("info_needs", "I would like to know what you had for lunch today. Just curious. Tell me."),
+    ("info_needs", "I don't know. I really don't care. Whatever you think is fine."),
+    ("additional_actions", "We should impose targeted sanctions on the officials involved."),
+    ("additional_actions", "Yes, the US should push for UN mediation and evacuate the embassy if needed."),
+    ("additional_actions", "No."),
+    ("additional_actions", "I think aid is enough, we shouldn't get more involved."),
+    ("additional_actions", "I already told you."),
+    ("additional_actions", "Can we talk about something else?"),
+    ("additional_actions", "What's the weather like in DC?"),
+    ("additional_actions", "thanks"),
+    ("additional_actions", "I refuse to answer. This is a stupid survey and I should not have to participate. Goodbye."),
+    ("additional_actions", "You should support me by sending my payment. I am done here. Enough."),
+    ("decision_factor", "I have no interest in this. It is boring. Let me go."),
+]
+
+def load_samples(path):
+    with open(path) as f:
+        return [(row["question_id"], row["message"]) for row in map(json.loads, f) if row]
+
+def llm_verdict(client, user_message, current_q):
+    start = time.perf_counter()
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=build_analysis_prompt(user_message, current_q).messages,
+        temperature=0
+    )
+    return parse_verdict(response.choices[0].message.content), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", help="JSONL file of samples (defaults to the built-in set)")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples) if args.samples else SAMPLES
+    questions = {q["id"]: q for q in QUESTIONS}
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    hits = agree = 0
+    local_times, llm_times = [], []
+    by_source = {}
+
+    for question_id, message in samples:
+        current_q = questions[question_id]
+
+        start = time.perf_counter()
+        local, source = classify(message, current_q)
+        local_times.append(time.perf_counter() - start)
+
+        expected, llm_time = llm_verdict(client, message, current_q)
+        llm_times.append(llm_time)
+
+        if local is None:
+            status = "llm"
+        else:
+            hits += 1
+            by_source[source] = by_source.get(source, 0) + 1
+            if local == expected:
+                agree += 1
+                status = source
+            else:
+                status = f"{source} MISMATCH"
+
+        print(f"[{status:14}] {question_id:18} local={local!s:5} llm={expected!s:5} {message!r}")
+
+    total = len(samples)
+    mean_llm = statistics.mean(llm_times)
+    mean_local = statistics.mean(local_times)
+    print()
+    print(f"Samples:             {total}")
+    print(f"Fast-path hit rate:  {hits}/{total} ({hits / total:.0%})  " +
+          ", ".join(f"{k}={v}" for k, v in sorted(by_source.items())))
+    if hits:
+        print(f"Agreement with LLM:  {agree}/{hits} ({agree / hits:.0%})")
+    print(f"Mean LLM check:      {mean_llm * 1000:.0f}ms")
+    print(f"Mean local check:    {mean_local * 1000:.3f}ms")
+    print(f"Latency saved/turn:  {(hits / total) * mean_llm * 1000 - mean_local * 1000:.0f}ms on average")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Concurrency governor shared by every upstream OpenAI call in a worker.
+
+  - at most UPSTREAM_MAX_IN_FLIGHT calls run at once; the rest queue
+  - a token bucket keeps estimated usage under UPSTREAM_TPM tokens/minute
+    (set it to the account limit divided by the number of workers)
+  - every call has a deadline; queueing, attempts and backoff all count against it
+  - 429/5xx/connection errors retry with full-jitter exponential backoff,
+    waiting at least as long as the server's Retry-After says
+  - a non-streaming attempt still running after UPSTREAM_HEDGE_AFTER seconds
+    gets a hedged duplicate if a slot is free; the first answer wins
+
+Calls take fn(timeout) so each attempt gets a timeout bounded by the time
+left. The OpenAI clients are created with max_retries=0 so the governor is the
+only thing retrying. For streams only the request that opens the stream is
+governed; the slot is released once tokens start flowing.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+import asyncio
+import os
+import random
+import threading
+import time
+
+import openai
+
+import metrics
+
+UPSTREAM_MAX_IN_FLIGHT = int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "32"))
+UPSTREAM_TPM = int(os.getenv("UPSTREAM_TPM", "0"))
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", "20"))
+UPSTREAM_STAGE_CHECK_DEADLINE = float(os.getenv("UPSTREAM_STAGE_CHECK_DEADLINE", "6"))
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", "10"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "4"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_CAP = float(os.getenv("UPSTREAM_BACKOFF_CAP", "8"))
+UPSTREAM_HEDGE_AFTER = float(os.getenv("UPSTREAM_HEDGE_AFTER", "0"))
+
+# Rough completion sizes used when reserving tokens from the TPM budget
+PERSONA_MAX_TOKENS = 200
+STAGE_CHECK_MAX_TOKENS = 5
+
+RETRYABLE = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError
+)
+
+class DeadlineExceeded(Exception):
+    """
+    The call could not finish (or start) before its deadline.
+    """
+
+# Failures where the participant should get a canned reply instead of an error
+DEGRADED = RETRYABLE + (DeadlineExceeded,)
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def backoff(attempt, error):
+    # Full jitter, but never sooner than the server asked for
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_CAP, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after(error) or 0)
+
+def usage_tokens(result):
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+class TokenBucket:
+    """
+    Tokens-per-minute budget. take() blocks until the estimate fits; settle()
+    corrects the estimate once the real usage is known.
+    """
+    def __init__(self, tpm):
+        self.capacity = tpm
+        self.rate = tpm / 60.0
+        self.available = float(tpm)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens):
+        if not self.capacity:
+            return True
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.available >= tokens:
+                self.available -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens):
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self.available) / self.rate)
+
+    def take(self, tokens, end):
+        while not self.try_take(tokens):
+            wait = self.wait_time(tokens)
+            if time.monotonic() + wait > end:
+                raise DeadlineExceeded("token budget exhausted until after the deadline")
+            time.sleep(min(wait, 0.25))
+
+    def settle(self, estimated, actual):
+        if not self.capacity or actual is None:
+            return
+        with self._lock:
+            self.available = min(self.capacity, self.available + estimated - actual)
+
+def _remaining(end):
+    return end - time.monotonic()
+
+class Governor:
+    def __init__(self, max_in_flight=UPSTREAM_MAX_IN_FLIGHT, tpm=UPSTREAM_TPM, hedge_after=UPSTREAM_HEDGE_AFTER):
+        self.max_in_flight = max_in_flight
+        self.hedge_after = hedge_after
+        self.bucket = TokenBucket(tpm)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upstream") if hedge_after else None
+
+    def call(self, fn, tokens=0, deadline=UPSTREAM_DEADLINE, hedge=True):
+        end = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(fn, tokens, end, hedge)
+                self.bucket.settle(tokens, usage_tokens(result))
+                return result
+            except RETRYABLE as e:
+                if attempt >= UPSTREAM_MAX_RETRIES:
+                    raise
+                delay = backoff(attempt, e)
+                if delay >= _remaining(end):
+                    metrics.registry.inc("upstream_deadline_exceeded_total")
+                    raise DeadlineExceeded(f"no time left to retry after: {e}") from e
+                metrics.registry.inc("upstream_retries_total", reason=type(e).__name__)
+                time.sleep(delay)
+                attempt += 1
+            except DeadlineExceeded:
+                metrics.registry.inc("upstream_deadline_exceeded_total")
+                raise
+
+    def _acquire(self, tokens, end):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=max(0.0, _remaining(end))):
+            raise DeadlineExceeded("timed out waiting for an upstream slot")
+        try:
+            self.bucket.take(tokens, end)
+        except BaseException:
+            self._slots.release()
+            raise
+        metrics.registry.observe("upstream_queue_seconds", time.monotonic() - start)
+
+    def _run(self, fn, end):
+        try:
+            timeout = min(UPSTREAM_ATTEMPT_TIMEOUT, _remaining(end))
+            if timeout <= 0:
+                raise DeadlineExceeded("deadline passed before the attempt started")
+            return fn(timeout)
+        finally:
+            self._slots.release()
+
+    def _attempt(self, fn, tokens, end, hedge):
+        self._acquire(tokens, end)
+        if not (hedge and self._pool):
+            return self._run(fn, end)
+
+        primary = self._pool.submit(self._run, fn, end)
+        try:
+            return primary.result(timeout=self.hedge_after)
+        except FutureTimeout:
+            pass
+
+        futures = [primary]
+        # Hedges never queue: only send one if a slot and budget are free right now
+        if self._slots.acquire(blocking=False):
+            if self.bucket.try_take(tokens):
+                metrics.registry.inc("upstream_hedges_total")
+                futures.append(self._pool.submit(self._run, fn, end))
+            else:
+                self._slots.release()
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
+class AsyncTokenBucket(TokenBucket):
+    async def take(self, tokens, end):
+        while not self.try_take(tokens):
+            wait = self.wait_time(tokens)
+            if time.monotonic() + wait > end:
+                raise DeadlineExceeded("token budget exhausted until after the deadline")
+            await asyncio.sleep(min(wait, 0.25))
+
+class AsyncGovernor:
+    """
+    Same policy as Governor for the async app; losing hedges are cancelled.
+    """
+    def __init__(self, max_in_flight=UPSTREAM_MAX_IN_FLIGHT, tpm=UPSTREAM_TPM, hedge_after=UPSTREAM_HEDGE_AFTER):
+        self.max_in_flight = max_in_flight
+        self.hedge_after = hedge_after
+        self.bucket = AsyncTokenBucket(tpm)
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def call(self, fn, tokens=0, deadline=UPSTREAM_DEADLINE, hedge=True):
+        end = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt(fn, tokens, end, hedge)
+                self.bucket.settle(tokens, usage_tokens(result))
+                return result
+            except RETRYABLE as e:
+                if attempt >= UPSTREAM_MAX_RETRIES:
+                    raise
+                delay = backoff(attempt, e)
+                if delay >= _remaining(end):
+                    metrics.registry.inc("upstream_deadline_exceeded_total")
+                    raise DeadlineExceeded(f"no time left to retry after: {e}") from e
+                metrics.registry.inc("upstream_retries_total", reason=type(e).__name__)
+                await asyncio.sleep(delay)
+                attempt += 1
+            except DeadlineExceeded:
+                metrics.registry.inc("upstream_deadline_exceeded_total")
+                raise
+
+    async def _acquire(self, tokens, end):
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, _remaining(end)))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("timed out waiting for an upstream slot")
+        try:
+            await self.bucket.take(tokens, end)
+        except BaseException:
+            # Includes CancelledError: Quart cancels the handler when the client disconnects
+            self._slots.release()
+            raise
+        metrics.registry.observe("upstream_queue_seconds", time.monotonic() - start)
+
+    async def _run(self, fn, end):
+        timeout = min(UPSTREAM_ATTEMPT_TIMEOUT, _remaining(end))
+        if timeout <= 0:
+            raise DeadlineExceeded("deadline passed before the attempt started")
+        return await fn(timeout)
+
+    def _start(self, fn, end):
+        # Released when the task ends, even if it is cancelled before it starts running
+        task = asyncio.ensure_future(self._run(fn, end))
+        task.add_done_callback(lambda _: self._slots.release())
+        return task
+
+    async def _attempt(self, fn, tokens, end, hedge):
+        await self._acquire(tokens, end)
+        if not (hedge and self.hedge_after):
+            try:
+                return await self._run(fn, end)
+            finally:
+                self._slots.release()
+
+        error = None
+        pending = {self._start(fn, end)}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return done.pop().result()
+
+            # Hedges never queue: only send one if a slot and budget are free right now
+            if not self._slots.locked() and self.bucket.try_take(tokens):
+                await self._slots.acquire()  # a slot is free, so this doesn't suspend
+                metrics.registry.inc("upstream_hedges_total")
+                pending.add(self._start(fn, end))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Losing hedges, or every attempt if this call itself was cancelled
+            for task in pending:
+                task.cancel()
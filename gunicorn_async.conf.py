@@ -0,0 +1,19 @@
+# Gunicorn settings for asgi_app.py:
+#   gunicorn -c gunicorn_async.conf.py asgi_app:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Each worker runs an event loop, so a couple per core is plenty;
+# concurrency comes from in-flight requests, not processes.
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2, 4)))
+
+# The app reads this to pick a session store every worker can see
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Upstream completions can take several seconds; keep the worker alive meanwhile.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 75
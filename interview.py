@@ -0,0 +1,261 @@
+"""
+Interview script, prompt construction and turn bookkeeping shared by the sync
+(app.py) and async (asgi_app.py) servers. Nothing in here talks to the network;
+the servers make the upstream calls and hand the results to the helpers below.
+"""
+import json
+import os
+from dotenv import load_dotenv
+from prompt_builder import build_prompt
+from stage_classifier import local_verdict, remember_verdict, best_guess
+import governor
+import metrics
+
+# Load environment variables (TURN_MODE etc. are read at import time)
+load_dotenv()
+
+# --- CONFIGURATION ---
+QUESTIONS = [
+    {
+        "id": "decision_factor",
+        "question": "What was the most important factor shaping your decision?",
+    },
+    {
+        "id": "info_needs",
+        "question": "Is there any other information you would want to know about the crisis in Kenya to make a better informed decision?",
+    },
+    {
+        "id": "additional_actions",
+        "question": "Beyond US aid, do you think the US should take any additional actions toward Kenya in light of the crisis?",
+    }
+]
+
+SYSTEM_PERSONA = (
+    "You are a senior director of the U.S. National Security Council. "
+    "Speak professionally and calmly. You are an authority figure. "
+    "Keep your responses concise (2-3 sentences max) to keep the user engaged."
+)
+
+MODEL = "gpt-4o-mini"
+
+# "two_call" = stage check then persona reply (default)
+# "single_call" = one structured-output call returning both, two-call path as fallback
+TURN_MODE = os.getenv("TURN_MODE", "two_call")
+
+# The single call decides the verdict at the persona's temperature (0.7), not the
+# stage check's 0, so a borderline message can advance on one try and hold on
+# the next. compare_turn_modes.py --repeat N reports how often that happens.
+TURN_SCHEMA = {
+    "name": "interview_turn",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "answered": {"type": "boolean"},
+            "reply": {"type": "string"}
+        },
+        "required": ["answered", "reply"],
+        "additionalProperties": False
+    }
+}
+
+def question_repeated(history, current_q):
+    # Safety Check: If the question text appears 2+ times, force move on
+    return sum(m["content"].count(current_q['question']) for m in history) >= 2
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "You are a logic engine. Analyze the user's latest message in the context of the question asked.\n\n"
+    "Did the user provide an answer to THIS SPECIFIC question?\n"
+    "(Accept brief or vague answers like \"none\", \"not sure\", or \"I already told you\", "
+    "but they must have replied to this topic)."
+)
+
+def build_analysis_prompt(user_message, current_q):
+    return build_prompt(
+        ANALYSIS_SYSTEM_PROMPT,
+        [],
+        f"Current Question Asked: \"{current_q['question']}\"\nUser's Latest Message: \"{user_message}\"",
+        "Respond with ONLY 'YES' or 'NO'."
+    )
+
+def parse_verdict(content):
+    return "YES" in content.upper()
+
+def build_task_instruction(current_index):
+    if current_index < len(QUESTIONS):
+        next_q = QUESTIONS[current_index]
+        return f"Acknowledge the user's point briefly. Then, ask EXACTLY this question: '{next_q['question']}'"
+    return "The interview is over. Thank them and tell them to click the arrow to proceed. Do not ask more questions."
+
+def fallback_reply(current_index):
+    """
+    Canned reply for when the persona call can't finish in time; it still
+    moves the interview along.
+    """
+    if current_index < len(QUESTIONS):
+        return f"Thank you, that is noted. {QUESTIONS[current_index]['question']}"
+    return "Thank you for your time and your input. Please click the arrow to proceed."
+
+def transcript_to_messages(transcript):
+    """
+    Reconstructs the chat history from the Qualtrics transcript string.
+    """
+    messages = []
+    if transcript:
+        for line in transcript.split("\n"):
+            line = line.strip()
+            if not line: continue
+            if line.startswith("YOU:"):
+                messages.append({"role": "user", "content": line.replace("YOU:", "").strip()})
+            elif line.startswith("NSC DIRECTOR:"):
+                messages.append({"role": "assistant", "content": line.replace("NSC DIRECTOR:", "").strip()})
+    return messages
+
+def build_persona_prompt(history, user_message, current_index):
+    return build_prompt(SYSTEM_PERSONA, history, user_message, f"CURRENT TASK: {build_task_instruction(current_index)}")
+
+def build_single_call_prompt(history, user_message, current_index):
+    current_q = QUESTIONS[current_index]
+
+    turn_instruction = (
+        f"CURRENT QUESTION: \"{current_q['question']}\"\n\n"
+        "STEP 1: Decide whether the user's latest message answers THIS SPECIFIC question. "
+        "Accept brief or vague answers like \"none\", \"not sure\", or \"I already told you\", "
+        "but they must have replied to this topic. Set \"answered\" accordingly.\n"
+        f"STEP 2: If answered is true, your task is: {build_task_instruction(current_index + 1)}\n"
+        f"If answered is false, your task is: {build_task_instruction(current_index)}\n"
+        "Put your response to the user in \"reply\"."
+    )
+
+    # Same prefix as the persona prompt, so both share the provider's cache
+    return build_prompt(SYSTEM_PERSONA, history, user_message, turn_instruction)
+
+def check_single_call_result(content, history, current_index):
+    """
+    Validates the structured output of a single-call turn.
+    Returns (answered, new_index, reply), or None if it can't be trusted.
+    """
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(result, dict):
+        return None
+
+    answered = result.get("answered")
+    reply = result.get("reply")
+    if not isinstance(answered, bool) or not isinstance(reply, str) or not reply.strip():
+        return None
+
+    # The model's reply would target the wrong question if it disagrees with
+    # the safety check, so let the two-call fallback handle that case.
+    if question_repeated(history, QUESTIONS[current_index]) and not answered:
+        return None
+
+    # Never move more than one stage per turn
+    return answered, current_index + 1 if answered else current_index, reply
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# --- REQUEST HANDLING SHARED BY BOTH SERVERS ---
+def parse_chat_request(payload, sessions):
+    """
+    Returns (user_message, history, current_index, session) for a /chat payload.
+
+    Session mode: the client sends "session_id" and only the new message, and the
+    history comes from the session store. Otherwise the history is rebuilt from the
+    "transcript" string. session is None in transcript mode, else
+    (session_id, history not yet in the store).
+    """
+    with metrics.span("parse"):
+        user_message = payload.get("message", "").strip()
+        session_id = payload.get("session_id")
+
+        # Receive the current stage from Qualtrics (0, 1, or 2)
+        stage = payload.get("current_stage_index")
+
+    with metrics.span("reconstruct"):
+        stored = sessions.get(session_id) if session_id else None
+        if stored is not None:
+            history, stored_stage = stored
+            session = (session_id, [])
+            if stage is None:
+                stage = stored_stage
+        else:
+            # Transcript mode, or a new/expired session seeded from the transcript
+            transcript = payload.get("transcript", "")
+            if session_id and not transcript and stage:
+                # Expired, or stored by another worker's memory store: the history is lost
+                print(f"Session Warning: unknown session {session_id} at stage {stage} with no transcript")
+            history = transcript_to_messages(transcript)
+            session = (session_id, history) if session_id else None
+
+    return user_message, history, int(stage or 0), session
+
+def save_turn(sessions, session, user_message, reply, current_index):
+    if session is None:
+        return
+    session_id, unsaved = session
+    sessions.append(session_id, unsaved + [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": reply}
+    ], current_index)
+
+def decide_stage_locally(history, user_message, current_q):
+    """
+    The stage verdict if it can be decided without the LLM, otherwise None.
+    """
+    if question_repeated(history, current_q):
+        metrics.note_verdict_source("repeat")
+        return True
+
+    # Obvious cases are decided locally; only unclear ones reach the LLM
+    verdict, source = local_verdict(user_message, current_q)
+    if verdict is not None:
+        metrics.note_verdict_source(source)
+    return verdict
+
+def stage_check_verdict(response, user_message, current_q):
+    metrics.record_upstream("stage_check", response)
+    verdict = parse_verdict(response.choices[0].message.content)
+    remember_verdict(user_message, current_q, verdict)
+    metrics.note_verdict_source("llm")
+    return verdict
+
+def stage_check_failed(error, user_message, current_q):
+    metrics.record_upstream("stage_check", error=True)
+    print(f"Logic Error: {error}")
+    if isinstance(error, governor.DEGRADED):
+        # Don't stall the participant on a rate limit or timeout: use the local guess
+        metrics.note_verdict_source("degraded")
+        return best_guess(user_message, current_q)
+    metrics.note_verdict_source("error")
+    return False
+
+def persona_degraded(error, current_index, call="persona"):
+    metrics.record_upstream("persona", error=True)
+    metrics.registry.inc("chat_degraded_replies_total", call=call)
+    print(f"Persona Error: {error}")
+    return fallback_reply(current_index)
+
+def single_call_verdict(response, history, current_index):
+    metrics.record_upstream("single_call", response)
+    result = check_single_call_result(response.choices[0].message.content, history, current_index)
+    if result is not None:
+        metrics.note_verdict_source("single_call")
+    return result
+
+def single_call_degraded(error, history, user_message, current_index):
+    """
+    The turn sent when the single call hits a rate limit or its deadline: the
+    local best guess for the verdict and the canned reply, with no further calls.
+    """
+    metrics.record_upstream("single_call", error=True)
+    metrics.note_verdict_source("degraded")
+    metrics.registry.inc("chat_degraded_replies_total", call="single_call")
+    print(f"Single-call Error: {error}")
+    current_q = QUESTIONS[current_index]
+    answered = question_repeated(history, current_q) or best_guess(user_message, current_q)
+    new_index = current_index + 1 if answered else current_index
+    return answered, new_index, fallback_reply(new_index)
@@ -0,0 +1,384 @@
+"""
+Per-turn hot-path instrumentation, exposed in Prometheus text format at /metrics.
+
+Each /chat request gets a Turn that collects timing spans (parse, reconstruct,
+stage_check, single_call, generate), upstream token usage and the stage
+outcome. When the turn finishes, those are folded into process-local counters
+and histograms. Recording is a dict update under a lock, so it can stay on in
+production.
+
+Workers don't share memory, so every process writes its totals to a snapshot
+file in METRICS_DIR after its first turn and then every METRICS_FLUSH_INTERVAL
+seconds from a background thread, and /metrics sums all snapshot files. The
+serving worker's own numbers are current; other workers' lag by up to
+METRICS_FLUSH_INTERVAL. Files from workers that have exited are folded into
+one exited.json (without their gauges), so counters never go backwards when
+gunicorn recycles a worker and the directory doesn't grow with every recycle.
+The default directory is keyed on the parent PID, which all workers of one
+gunicorn master share.
+
+METRICS_LOG=1 also prints one JSON line per request.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import atexit
+import contextvars
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), f"talking-politics-metrics-{os.getppid()}")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_LOG = os.getenv("METRICS_LOG", "0") == "1"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "chat_requests_total": ("counter", "Chat requests by endpoint and HTTP status."),
+    "chat_request_seconds": ("histogram", "Wall time of a chat request."),
+    "chat_span_seconds": ("histogram", "Wall time of each hot-path step of a chat request."),
+    "chat_stage_outcomes_total": ("counter", "Stage decisions by outcome and by what decided them."),
+    "upstream_calls_total": ("counter", "OpenAI calls by call type and result."),
+    "upstream_tokens_total": ("counter", "OpenAI tokens reported in response usage."),
+    "upstream_queue_seconds": ("histogram", "Time an upstream call waited for a slot and token budget."),
+    "upstream_retries_total": ("counter", "Upstream retries by error type."),
+    "upstream_hedges_total": ("counter", "Hedged duplicate requests sent for slow upstream calls."),
+    "upstream_deadline_exceeded_total": ("counter", "Upstream calls abandoned at their deadline."),
+    "chat_degraded_replies_total": ("counter", "Canned replies sent because the upstream call failed or timed out."),
+    "turn_log_records_total": ("counter", "Research turn records by result (written / dropped)."),
+    "turn_log_backlog": ("gauge", "Turn records queued but not yet on disk."),
+}
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        # Gauges live alongside counters; summing them across workers gives the total
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                # [per-bucket counts incl. +Inf, sum, count]
+                hist = self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            hist[0][bisect_left(BUCKETS, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, dict(labels), list(h[0]), h[1], h[2]] for (name, labels), h in self.histograms.items()]
+            }
+
+registry = Registry()
+
+current_turn = contextvars.ContextVar("current_turn", default=None)
+
+class Turn:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.tokens = {}
+        self.outcome = None
+        self.verdict_source = None
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def stage(self, old_index, new_index, total):
+        if old_index >= total:
+            self.outcome = "complete"
+        elif new_index > old_index:
+            self.outcome = "advanced"
+        else:
+            self.outcome = "held"
+
+    def timings(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "spans_ms": {k: round(v * 1000, 1) for k, v in self.spans.items()}
+        }
+
+    def finish(self, status):
+        elapsed = time.perf_counter() - self.start
+        registry.inc("chat_requests_total", endpoint=self.endpoint, status=str(status))
+        registry.observe("chat_request_seconds", elapsed, endpoint=self.endpoint)
+        for name, seconds in self.spans.items():
+            registry.observe("chat_span_seconds", seconds, span=name)
+        if self.outcome is not None:
+            registry.inc("chat_stage_outcomes_total", outcome=self.outcome, source=self.verdict_source or "none")
+
+        if METRICS_LOG:
+            print(json.dumps({
+                "event": "chat_turn",
+                "endpoint": self.endpoint,
+                "status": status,
+                "ms": round(elapsed * 1000, 1),
+                "spans_ms": {k: round(v * 1000, 1) for k, v in self.spans.items()},
+                "tokens": self.tokens,
+                "outcome": self.outcome,
+                "verdict_source": self.verdict_source
+            }), flush=True)
+
+        _flush_first_turn()
+
+def start_turn(endpoint):
+    _ensure_flusher()
+    turn = Turn(endpoint)
+    current_turn.set(turn)
+    return turn
+
+@contextmanager
+def span(name):
+    """
+    Times a step of the current turn; does nothing outside a request.
+    """
+    turn = current_turn.get()
+    if turn is None:
+        yield
+        return
+    with turn.span(name):
+        yield
+
+def note_verdict_source(source):
+    turn = current_turn.get()
+    if turn is not None:
+        turn.verdict_source = source
+
+def record_upstream(call, response=None, error=False):
+    """
+    Counts an upstream call and the token usage on its response (or final stream chunk).
+    """
+    registry.inc("upstream_calls_total", call=call, result="error" if error else "ok")
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    turn = current_turn.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None) or 0
+        registry.inc("upstream_tokens_total", count, call=call, kind=kind.replace("_tokens", ""))
+        if turn is not None:
+            turn.tokens[f"{call}_{kind}"] = turn.tokens.get(f"{call}_{kind}", 0) + count
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    if cached:
+        registry.inc("upstream_tokens_total", cached, call=call, kind="cached_prompt")
+
+# --- CROSS-WORKER AGGREGATION ---
+_process_id = f"{os.getpid()}-{int(time.time() * 1000)}"
+_flush_lock = threading.Lock()
+_flusher = None
+_flushed_first_turn = False
+
+def _after_fork():
+    # With --preload, workers fork after this module is imported: give each
+    # its own snapshot file and don't double-count whatever the parent recorded.
+    # The flusher thread doesn't survive fork; the next turn starts a new one.
+    global _process_id, _flush_lock, _flusher, _flushed_first_turn
+    _process_id = f"{os.getpid()}-{int(time.time() * 1000)}"
+    _flush_lock = threading.Lock()
+    _flusher = None
+    _flushed_first_turn = False
+    registry.__init__()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def flush():
+    with _flush_lock:
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{_process_id}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Metrics Error: {e}")
+
+def _flush_forever():
+    # Also publishes counters bumped outside a turn (governor retries, turn log
+    # writes) and the last turns before a worker goes idle
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+def _flush_first_turn():
+    # A new worker shows up on /metrics right away, not one interval later
+    global _flushed_first_turn
+    if not _flushed_first_turn:
+        _flushed_first_turn = True
+        flush()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flush_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name="metrics-flusher", daemon=True)
+            _flusher.start()
+
+atexit.register(flush)
+
+def _pid_alive(path):
+    try:
+        pid = int(os.path.basename(path).split("-", 1)[0])
+        os.kill(pid, 0)
+    except ValueError:
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+EXITED_FILE = "exited.json"
+
+def _gauge_names():
+    return {name for name, (kind, _) in HELP.items() if kind == "gauge"}
+
+def _accumulate(counters, histograms, snapshot, skip=()):
+    for name, labels, value in snapshot["counters"]:
+        if name in skip:
+            continue
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, buckets, total, count in snapshot["histograms"]:
+        key = (name, tuple(sorted(labels.items())))
+        merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+        merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+        merged[1] += total
+        merged[2] += count
+
+def fold_exited():
+    """
+    Merges the snapshot files of exited workers into EXITED_FILE and removes
+    them. "folded" lists files already merged, so a crash between writing
+    EXITED_FILE and removing them can't count them twice.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    with open(os.path.join(METRICS_DIR, ".fold.lock"), "w") as lock:
+        # Every worker serving /metrics may fold at once
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [
+            path for path in glob.glob(os.path.join(METRICS_DIR, "*.json"))
+            if os.path.basename(path) != EXITED_FILE and not _pid_alive(path)
+        ]
+        if not dead:
+            return
+
+        try:
+            with open(exited_path) as f:
+                exited = json.load(f)
+        except FileNotFoundError:
+            exited = {"counters": [], "histograms": [], "folded": []}
+        # Names whose files are gone were removed after an earlier fold
+        folded = set(exited.get("folded", [])) & {os.path.basename(path) for path in dead}
+
+        counters, histograms = {}, {}
+        _accumulate(counters, histograms, exited)
+        for path in dead:
+            name = os.path.basename(path)
+            if name in folded:
+                continue
+            try:
+                with open(path) as f:
+                    _accumulate(counters, histograms, json.load(f), skip=_gauge_names())
+            except (OSError, ValueError):
+                continue
+            folded.add(name)
+
+        exited = {
+            "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            "histograms": [[name, dict(labels), list(h[0]), h[1], h[2]] for (name, labels), h in histograms.items()],
+            "folded": sorted(folded)
+        }
+        tmp = f"{exited_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(exited, f)
+        os.replace(tmp, exited_path)
+
+        for path in dead:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def merged_snapshots():
+    flush()
+    try:
+        fold_exited()
+    except (OSError, ValueError) as e:
+        print(f"Metrics Error: {e}")
+
+    counters, histograms = {}, {}
+    paths = glob.glob(os.path.join(METRICS_DIR, "*.json"))
+    snapshots = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                snapshots.append((json.load(f), _pid_alive(path)))
+        except (OSError, ValueError):
+            continue
+    if not snapshots:
+        snapshots = [(registry.snapshot(), True)]
+
+    for snapshot, alive in snapshots:
+        # A gauge from an exited worker is stale, unlike its counters
+        _accumulate(counters, histograms, snapshot, skip=() if alive else _gauge_names())
+    return counters, histograms
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+def render():
+    """
+    All workers' metrics in Prometheus text exposition format.
+    """
+    counters, histograms = merged_snapshots()
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind in ("counter", "gauge"):
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        else:
+            for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ("+Inf",), buckets):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+"""
+Prompt assembly for every upstream call.
+
+Layout: [static system prompt] [history, oldest first] [user message] [per-turn instruction]
+
+Everything up to the user message is identical from one turn to the next, so
+the provider's prefix cache keeps hitting; only the tail changes. When the
+history outgrows PROMPT_TOKEN_BUDGET, the oldest turns are folded into a short
+summary note. Trimming happens in whole chunks so the kept prefix stays
+byte-stable for several turns instead of shifting every turn.
+
+Token counts use tiktoken when it is installed. The servers start loading its
+encoding in the background when a worker starts (preload_encoding); until it
+is ready, or if it can't be fetched, counts use a character estimate. On hosts
+without network access, ship the cached file (TIKTOKEN_CACHE_DIR).
+"""
+from collections import namedtuple
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+TRIM_CHUNK = max(1, int(os.getenv("PROMPT_TRIM_CHUNK", "6")))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("PROMPT_SUMMARY_TOKENS", "300"))
+SUMMARY_WORDS_PER_LINE = 30
+
+# messages: what to send; tokens: estimated input tokens; trimmed: history messages folded into the summary
+Prompt = namedtuple("Prompt", ["messages", "tokens", "trimmed"])
+
+_encoding = None
+_encoding_started = False
+_encoding_lock = threading.Lock()
+
+def _load_encoding():
+    global _encoding
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Not retried: counting stays on the character estimate
+        print(f"Tokenizer Error: {e}")
+
+def preload_encoding():
+    """
+    Starts loading the tokenizer in a background thread. Without a cached
+    encoding file tiktoken downloads it with no timeout, so nothing on the
+    request path (or the event loop) ever waits for it.
+    """
+    global _encoding_started
+    if tiktoken is None or _encoding_started:
+        return
+    with _encoding_lock:
+        if _encoding_started:
+            return
+        _encoding_started = True
+    threading.Thread(target=_load_encoding, name="tokenizer-load", daemon=True).start()
+
+def _after_fork():
+    # A load still running in the parent doesn't survive fork; start another
+    global _encoding_started, _encoding_lock
+    _encoding_lock = threading.Lock()
+    if _encoding is None:
+        _encoding_started = False
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def count_tokens(text):
+    encoding = _encoding
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Tokenizer not loaded (yet): ~4 characters per token is close enough for budgeting
+    preload_encoding()
+    return len(text) // 4 + 1
+
+def count_message_tokens(messages):
+    # Each message carries ~4 tokens of framing, plus 3 to prime the reply
+    return sum(4 + count_tokens(m["content"]) for m in messages) + 3
+
+def summarize(dropped):
+    """
+    Extractive summary of trimmed turns: what the participant said, newest kept
+    first when the note itself would blow its budget.
+    """
+    lines = []
+    for m in dropped:
+        if m["role"] != "user":
+            continue
+        words = m["content"].split()
+        text = " ".join(words[:SUMMARY_WORDS_PER_LINE]) + (" ..." if len(words) > SUMMARY_WORDS_PER_LINE else "")
+        lines.append(f"- {text}")
+
+    while lines:
+        note = "Summary of earlier conversation. The participant said:\n" + "\n".join(lines)
+        if count_tokens(note) <= SUMMARY_TOKEN_BUDGET:
+            return {"role": "system", "content": note}
+        lines.pop(0)
+    return None
+
+def build_prompt(system, history, user_message, instruction, budget=None):
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+
+    head = [{"role": "system", "content": system}]
+    tail = [{"role": "user", "content": user_message}]
+    if instruction:
+        tail.append({"role": "system", "content": instruction})
+
+    fixed = count_message_tokens(head + tail)
+    kept = list(history)
+    trimmed = 0
+    summary = None
+    tokens = fixed + count_message_tokens(kept) - 3
+
+    while kept and tokens > budget:
+        # Drop a whole chunk so the next few turns reuse the same prefix
+        trimmed = min(trimmed + TRIM_CHUNK, len(history))
+        kept = history[trimmed:]
+        summary = summarize(history[:trimmed])
+        tokens = fixed + count_message_tokens(kept + ([summary] if summary else [])) - 3
+
+    messages = head + ([summary] if summary else []) + kept + tail
+    return Prompt(messages, tokens, trimmed)
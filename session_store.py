@@ -0,0 +1,155 @@
+"""
+Server-side conversation history for session mode.
+
+In session mode Qualtrics sends {"session_id", "message", "current_stage_index"}
+and the server keeps the structured message history, instead of the client
+resending the whole transcript on every turn.
+
+Backends (SESSION_BACKEND):
+  memory - per-process dict with TTL + LRU eviction. Only correct with one worker.
+  sqlite - a SQLite file (SESSION_DB_PATH) shared by every gunicorn worker on the host.
+
+Without SESSION_BACKEND the default is memory for a single worker and sqlite
+when WEB_CONCURRENCY says more than one worker runs.
+"""
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND") or ("sqlite" if WORKERS > 1 else "memory")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "7200"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+class MemorySessionStore:
+    """
+    Sessions expire SESSION_TTL seconds after their last turn; the least
+    recently used ones are evicted beyond SESSION_MAX.
+    """
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Returns (history, stage) or None if the session is unknown or expired.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, history, stage = entry
+            if expires_at < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(history), stage
+
+    def append(self, session_id, new_messages, stage):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            history = entry[1] if entry and entry[0] >= time.monotonic() else []
+            history.extend(new_messages)
+            self._sessions[session_id] = (time.monotonic() + self.ttl, history, stage)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+class SQLiteSessionStore:
+    """
+    Same interface as MemorySessionStore, backed by a WAL-mode SQLite file so
+    all workers see the same sessions.
+    """
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._last_purge = 0.0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, history TEXT NOT NULL, stage INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT history, stage FROM sessions WHERE session_id = ? AND updated >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def append(self, session_id, new_messages, stage):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT history FROM sessions WHERE session_id = ? AND updated >= ?",
+                (session_id, now - self.ttl)
+            ).fetchone()
+            history = json.loads(row[0]) if row else []
+            history.extend(new_messages)
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, history, stage, updated) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(history), stage, now)
+            )
+            if now - self._last_purge > 60:
+                conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+                self._last_purge = now
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _open_store(backend):
+    if backend == "memory":
+        if WORKERS > 1:
+            print(f"Session Warning: memory sessions with {WORKERS} workers; turns landing on another worker lose their history")
+        return MemorySessionStore()
+    return SQLiteSessionStore()
+
+class LazySessionStore:
+    """
+    Opens the backend on the first session-mode request, so transcript-only
+    deployments never create a session database.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self._store = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = _open_store(self.backend)
+        return self._store
+
+    def get(self, session_id):
+        return self._open().get(session_id)
+
+    def append(self, session_id, new_messages, stage):
+        self._open().append(session_id, new_messages, stage)
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend not in ("memory", "sqlite"):
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    return LazySessionStore(backend)
@@ -0,0 +1,230 @@
+"""
+Local fast path for the "was the current question answered?" check.
+
+Tiers, cheapest first:
+  1. memo  - bounded LRU of earlier verdicts keyed on (question id, normalized message)
+  2. rule  - obvious brief answers ("none", "not sure", ...) and pure greetings
+  3. model - small keyword/length scorer per question id; only trusted when confident,
+             and never for "answered" unless the reply touches the question's topic
+Anything still unclear returns None so the caller asks gpt-4o-mini.
+"""
+from collections import OrderedDict
+import math
+import os
+import re
+import threading
+
+STAGE_FAST_PATH = os.getenv("STAGE_FAST_PATH", "1") == "1"
+STAGE_FAST_PATH_CONFIDENCE = float(os.getenv("STAGE_FAST_PATH_CONFIDENCE", "0.9"))
+STAGE_MEMO_SIZE = int(os.getenv("STAGE_MEMO_SIZE", "4096"))
+# One term unique to the question (weight ~1.39), or two shared ones
+STAGE_MIN_TOPIC_SCORE = float(os.getenv("STAGE_MIN_TOPIC_SCORE", "1.0"))
+
+# Brief or vague replies the analysis prompt says to accept for any question
+ACCEPTED_BRIEF_ANSWERS = {
+    "none", "nothing", "not sure", "im not sure", "i am not sure", "unsure", "no idea",
+    "i dont know", "dont know", "idk", "hard to say", "i already told you", "already told you",
+    "i already answered", "n/a", "na"
+}
+
+# Never an answer on their own
+GREETINGS = {
+    "hi", "hello", "hey", "hi there", "hello there", "good morning", "good afternoon",
+    "good evening", "thanks", "thank you", "ok", "okay"
+}
+
+QUESTION_WORDS = ("what", "why", "how", "who", "which", "can", "could", "would you", "do you", "are you", "is this")
+QUESTION_START = re.compile(r"(%s)\b" % "|".join(QUESTION_WORDS))
+
+# The participant didn't follow the question; never decided locally
+CLARIFICATION_PHRASES = (
+    "what do you mean", "what you mean", "what does that mean", "explain the question", "explain again",
+    "explain it again", "repeat it", "repeat that", "repeat the question", "rephrase",
+    "confused", "dont understand", "didnt understand", "dont get", "didnt read", "didnt see",
+    "not paying attention", "wasnt paying attention", "what question", "which question", "what crisis"
+)
+
+# Per-question features. "brief" adds accepted brief answers for yes/no style
+# questions; "question_penalty" is how much asking a question back counts against
+# an answer (asking for more facts IS an answer to info_needs).
+QUESTION_FEATURES = {
+    "decision_factor": {
+        "terms": [
+            "cost", "money", "budget", "taxpayer", "taxpayers", "humanitarian", "lives", "life",
+            "security", "stability", "stable", "terror", "terrorism", "shabaab", "ally", "allies",
+            "alliance", "national interest", "interests", "china", "russia", "influence", "moral", "morally",
+            "values", "risk", "risks", "troops", "personnel", "economy", "economic", "refugees",
+            "democracy", "region", "regional", "priority", "safety", "national",
+            "suffering", "obligation"
+        ],
+        "brief": set(),
+        "question_penalty": 2.0
+    },
+    "info_needs": {
+        "terms": [
+            "information", "casualties", "deaths", "died", "displaced", "refugees",
+            "government", "how many", "how much", "timeline", "details", "cause", "causes",
+            "history", "intelligence", "data", "numbers", "response", "status", "outcome",
+            "impact", "long term", "what happened", "plan", "allies", "cost"
+        ],
+        "brief": {"no", "nope", "not really", "no thanks", "no thank you", "nothing else", "no more", "thats all", "yes"},
+        "question_penalty": 0.0
+    },
+    "additional_actions": {
+        "terms": [
+            "sanctions", "sanction", "diplomacy", "diplomatic", "troops", "military", "mediate",
+            "mediation", "negotiate", "negotiations", "united nations", "un", "peacekeeping",
+            "peacekeepers", "evacuate", "evacuation", "embassy", "condemn", "pressure",
+            "intervene", "intervention", "trade", "stay out", "get involved", "more involved",
+            "aid is enough"
+        ],
+        "brief": {"no", "nope", "not really", "yes", "yes they should", "no they shouldnt", "nothing more", "thats enough"},
+        "question_penalty": 2.0
+    }
+}
+
+def _idf_weights():
+    # Terms shared between questions say less about which topic the user is on
+    counts = {}
+    for features in QUESTION_FEATURES.values():
+        for term in set(features["terms"]):
+            counts[term] = counts.get(term, 0) + 1
+    n = len(QUESTION_FEATURES)
+    return {term: math.log(1 + n / df) for term, df in counts.items()}
+
+TERM_WEIGHTS = _idf_weights()
+
+def normalize(message):
+    message = message.lower().replace("’", "'").replace("'", "")
+    message = re.sub(r"[^a-z0-9/?.!\s]", " ", message)
+    return " ".join(message.split())
+
+def _bare(normalized):
+    return normalized.strip(" ?.!")
+
+def _sentences(normalized):
+    return [s.strip() for s in re.findall(r"[^.!?]+[.!?]*", normalized) if s.strip(" .!?")]
+
+def asks_back(normalized):
+    # A question anywhere in the message counts, not just a trailing one
+    return any(s.endswith("?") or QUESTION_START.match(s) for s in _sentences(normalized))
+
+def asks_for_clarification(normalized):
+    text = f" {re.sub(r'[?.!]', ' ', normalized)} "
+    return any(f" {phrase} " in text for phrase in CLARIFICATION_PHRASES)
+
+def _answer_probability(normalized, features):
+    """
+    Returns (probability the message answers the question, topic score).
+    """
+    text = f" {re.sub(r'[?.!]', ' ', normalized)} "
+    words = text.split()
+    sentences = max(1, len(_sentences(normalized)))
+
+    topic_score = sum(TERM_WEIGHTS[term] for term in set(features["terms"]) if f" {term} " in text)
+
+    logit = (
+        -2.5
+        + 1.2 * topic_score
+        + 0.8 * min(sentences, 3)
+        + 0.05 * min(len(words), 40)
+        - features["question_penalty"] * asks_back(normalized)
+    )
+    return 1 / (1 + math.exp(-logit)), topic_score
+
+def classify(user_message, current_q):
+    """
+    Returns (verdict, source) from the rule and model tiers; verdict is None
+    when the local tiers aren't confident enough.
+    """
+    features = QUESTION_FEATURES.get(current_q["id"])
+    normalized = normalize(user_message)
+    bare = _bare(normalized)
+
+    if bare in ACCEPTED_BRIEF_ANSWERS or (features and bare in features["brief"]):
+        return True, "rule"
+    if bare in GREETINGS:
+        return False, "rule"
+    if features is None or not bare or asks_for_clarification(normalized):
+        return None, None
+
+    p, topic_score = _answer_probability(normalized, features)
+    # Length alone never proves an answer; it has to be about the question's topic
+    if p >= STAGE_FAST_PATH_CONFIDENCE and topic_score >= STAGE_MIN_TOPIC_SCORE:
+        return True, "model"
+    if 1 - p >= STAGE_FAST_PATH_CONFIDENCE:
+        return False, "model"
+    return None, None
+
+def best_guess(user_message, current_q):
+    """
+    The local verdict with no confidence threshold, for when the LLM check
+    can't be reached. Unknown questions count as answered so nobody gets stuck.
+    """
+    verdict, _ = classify(user_message, current_q)
+    if verdict is not None:
+        return verdict
+    features = QUESTION_FEATURES.get(current_q["id"])
+    if features is None:
+        return True
+    normalized = normalize(user_message)
+    if asks_for_clarification(normalized):
+        return False
+    p, topic_score = _answer_probability(normalized, features)
+    return p >= 0.5 and topic_score >= STAGE_MIN_TOPIC_SCORE
+
+class VerdictMemo:
+    """
+    Thread-safe bounded LRU of verdicts keyed on (question id, normalized message).
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, verdict):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = verdict
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+memo = VerdictMemo(STAGE_MEMO_SIZE)
+
+def local_verdict(user_message, current_q):
+    """
+    Returns (verdict, source) if the fast path can decide without the LLM,
+    otherwise (None, None). source is "memo", "rule" or "model".
+    """
+    if not STAGE_FAST_PATH:
+        return None, None
+
+    key = (current_q["id"], normalize(user_message))
+    verdict = memo.get(key)
+    if verdict is not None:
+        return verdict, "memo"
+
+    verdict, source = classify(user_message, current_q)
+    if verdict is not None:
+        memo.put(key, verdict)
+    return verdict, source
+
+def remember_verdict(user_message, current_q, verdict):
+    """
+    Stores an LLM verdict so the same reply to the same question is free next time.
+    """
+    if STAGE_FAST_PATH:
+        memo.put((current_q["id"], normalize(user_message)), verdict)
@@ -0,0 +1,66 @@
+"""
+Slot accounting in governor.AsyncGovernor: a cancelled call (the client closed
+the tab) must give its upstream slot back.
+
+Run with:  python -m pytest tests
+"""
+import asyncio
+import unittest
+
+import governor
+
+class AsyncGovernorSlotTest(unittest.IsolatedAsyncioTestCase):
+    async def assert_slots_free(self, upstream):
+        # Done callbacks that release hedge slots run on the next loop turns
+        for _ in range(5):
+            await asyncio.sleep(0)
+        self.assertEqual(upstream._slots._value, upstream.max_in_flight)
+
+    async def test_cancelled_wait_for_token_budget_releases_slot(self):
+        upstream = governor.AsyncGovernor(max_in_flight=2, tpm=600, hedge_after=0)
+        upstream.bucket.available = 0
+
+        async def never_called(timeout):
+            raise AssertionError("no budget, so no attempt should start")
+
+        waiting = [asyncio.ensure_future(upstream.call(never_called, tokens=100, deadline=30)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+        await self.assert_slots_free(upstream)
+
+    async def test_cancelled_hedged_call_releases_every_slot(self):
+        upstream = governor.AsyncGovernor(max_in_flight=4, tpm=0, hedge_after=0.01)
+
+        async def slow(timeout):
+            await asyncio.sleep(10)
+
+        call = asyncio.ensure_future(upstream.call(slow, deadline=30))
+        await asyncio.sleep(0.05)
+        self.assertEqual(upstream._slots._value, 2)  # primary + hedge in flight
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+        await self.assert_slots_free(upstream)
+
+    async def test_slots_survive_repeated_disconnects(self):
+        upstream = governor.AsyncGovernor(max_in_flight=2, tpm=600, hedge_after=0)
+        upstream.bucket.available = 0
+        for _ in range(5):
+            task = asyncio.ensure_future(upstream.call(lambda timeout: None, tokens=100, deadline=30))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        upstream.bucket.available = upstream.bucket.capacity
+
+        async def answer(timeout):
+            return "ok"
+
+        self.assertEqual(await upstream.call(answer, tokens=100, deadline=1), "ok")
+        await self.assert_slots_free(upstream)
+
+if __name__ == "__main__":
+    unittest.main()
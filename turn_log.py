@@ -0,0 +1,274 @@
+"""
+Durable research record of every chat turn, written off the request path.
+
+record() only puts the turn on a bounded in-process queue; it never touches
+the disk and never blocks. If the queue is full the record is dropped and
+counted. A background thread drains the queue in batches, appends them to a
+JSONL file and fsyncs each batch. At exit it drains whatever is left.
+
+Each process writes its own files (host, PID and start time are in the name),
+so gunicorn workers never interleave writes. Files rotate by size or age.
+With TURN_LOG_COMPRESS=1 a rotated file is gzipped and the original removed
+once the .gz is safely on disk.
+
+Read the files back with load_turns(), which streams one record at a time:
+
+    for turn in load_turns("turn_logs"):
+        ...
+
+or from the shell: python turn_log.py turn_logs
+"""
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import socket
+import sys
+import threading
+import time
+
+import metrics
+from interview import QUESTIONS
+
+TURN_LOG_ENABLED = os.getenv("TURN_LOG_ENABLED", "1") == "1"
+TURN_LOG_DIR = os.getenv("TURN_LOG_DIR", "turn_logs")
+TURN_LOG_QUEUE_SIZE = int(os.getenv("TURN_LOG_QUEUE_SIZE", "10000"))
+TURN_LOG_BATCH_SIZE = int(os.getenv("TURN_LOG_BATCH_SIZE", "200"))
+TURN_LOG_FLUSH_INTERVAL = float(os.getenv("TURN_LOG_FLUSH_INTERVAL", "1.0"))
+TURN_LOG_ROTATE_BYTES = int(os.getenv("TURN_LOG_ROTATE_BYTES", str(64 * 1024 * 1024)))
+TURN_LOG_ROTATE_SECONDS = float(os.getenv("TURN_LOG_ROTATE_SECONDS", "3600"))
+TURN_LOG_COMPRESS = os.getenv("TURN_LOG_COMPRESS", "1") == "1"
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class TurnWriter:
+    def __init__(self, directory=TURN_LOG_DIR, queue_size=TURN_LOG_QUEUE_SIZE, batch_size=TURN_LOG_BATCH_SIZE,
+                 flush_interval=TURN_LOG_FLUSH_INTERVAL, rotate_bytes=TURN_LOG_ROTATE_BYTES,
+                 rotate_seconds=TURN_LOG_ROTATE_SECONDS, compress=TURN_LOG_COMPRESS):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._seq = 0
+
+    def record(self, turn):
+        """
+        Queues one turn record (a JSON-serializable dict). Never blocks.
+        """
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(turn)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            metrics.registry.inc("turn_log_records_total", result="dropped")
+
+    def stats(self):
+        with self._lock:
+            return {"written": self.written, "dropped": self.dropped, "backlog": self.queue.qsize()}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="turn-log-writer", daemon=True)
+                self._thread.start()
+
+    def close(self, timeout=10):
+        """
+        Drains the queue to disk and closes the current file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # --- WRITER THREAD ---
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+            elif self._file is not None and time.monotonic() - self._opened_at >= self.rotate_seconds:
+                self._rotate()
+
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                break
+            self._write(batch)
+        self._close_file()
+        metrics.registry.set("turn_log_backlog", self.queue.qsize())
+
+    def _take_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait())
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        data = "".join(json.dumps(turn, ensure_ascii=False, default=str) + "\n" for turn in batch).encode()
+        try:
+            f = self._current_file()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        except OSError as e:
+            print(f"Turn Log Error: {e}")
+            with self._lock:
+                self.dropped += len(batch)
+            metrics.registry.inc("turn_log_records_total", len(batch), result="dropped")
+            self._close_file()
+            return
+
+        with self._lock:
+            self.written += len(batch)
+        metrics.registry.inc("turn_log_records_total", len(batch), result="written")
+        metrics.registry.set("turn_log_backlog", self.queue.qsize())
+
+        if f.tell() >= self.rotate_bytes or time.monotonic() - self._opened_at >= self.rotate_seconds:
+            self._rotate()
+
+    def _current_file(self):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._seq += 1
+            stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+            name = f"turns-{socket.gethostname()}-{os.getpid()}-{stamp}-{self._seq:04d}.jsonl"
+            self._path = os.path.join(self.directory, name)
+            self._file = open(self._path, "ab")
+            self._opened_at = time.monotonic()
+            _fsync_dir(self.directory)
+        return self._file
+
+    def _close_file(self):
+        if self._file is None:
+            return None
+        path = self._path
+        try:
+            self._file.close()
+        except OSError as e:
+            print(f"Turn Log Error: {e}")
+        self._file = None
+        self._path = None
+        return path
+
+    def _rotate(self):
+        path = self._close_file()
+        if not path or not self.compress:
+            return
+        tmp = f"{path}.gz.tmp"
+        try:
+            with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            with open(tmp, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp, f"{path}.gz")
+            _fsync_dir(self.directory)
+            os.remove(path)
+        except OSError as e:
+            # The plain .jsonl is still complete; leave it for the loader
+            print(f"Turn Log Error: {e}")
+
+writer = TurnWriter()
+
+def _after_fork():
+    # The writer thread doesn't survive fork; each worker starts its own lazily
+    global writer
+    writer = TurnWriter()
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(lambda: writer.close())
+
+def record(turn):
+    if TURN_LOG_ENABLED:
+        writer.record(turn)
+
+def capture(turn, session, user_message, history, old_index, new_index, answered, reply, error=None):
+    """
+    Builds the research record for one chat turn and queues it.
+    """
+    record({
+        "ts": time.time(),
+        "endpoint": turn.endpoint,
+        "session_id": session[0] if session else None,
+        "question_id": QUESTIONS[old_index]["id"] if old_index < len(QUESTIONS) else None,
+        "stage_in": old_index,
+        "stage_out": new_index,
+        "answered": answered,
+        "verdict_source": turn.verdict_source,
+        "outcome": turn.outcome,
+        "message": user_message,
+        "reply": reply,
+        "history": history,
+        "error": error,
+        "tokens": turn.tokens,
+        **turn.timings()
+    })
+
+# --- LOADER ---
+def turn_files(path):
+    if os.path.isfile(path):
+        return [path]
+    compressed = glob.glob(os.path.join(path, "*.jsonl.gz"))
+    # Skip a plain file caught mid-rotation once its .gz exists
+    plain = [f for f in glob.glob(os.path.join(path, "*.jsonl")) if f"{f}.gz" not in compressed]
+    return sorted(plain + compressed)
+
+def load_turns(path=TURN_LOG_DIR):
+    """
+    Yields turn records one at a time from a file or a directory of .jsonl /
+    .jsonl.gz files. A torn last line (crash mid-write) is skipped.
+    """
+    for file_path in turn_files(path):
+        opener = gzip.open if file_path.endswith(".gz") else open
+        with opener(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+if __name__ == "__main__":
+    total = 0
+    outcomes = {}
+    for turn in load_turns(sys.argv[1] if len(sys.argv) > 1 else TURN_LOG_DIR):
+        total += 1
+        outcomes[turn.get("outcome")] = outcomes.get(turn.get("outcome"), 0) + 1
+    print(f"Turns: {total}")
+    for outcome, count in sorted(outcomes.items(), key=lambda kv: str(kv[0])):
+        print(f"  {outcome}: {count}")